@@ -1,19 +1,26 @@
 """
 Django admin configuration for the CCL Reservation System
 """
+import copy
+
 from django.contrib import admin
 from django import forms
-from django.contrib.admin.widgets import FilteredSelectMultiple
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.admin.widgets import AutocompleteSelectMultiple
 from django.shortcuts import redirect
 from django.contrib import messages
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Q
 from django.utils.html import format_html
 
 from .models import (
-    FoodItem, Option, LunchForm, SnacksForm, 
+    FoodItem, Option, Form, LunchForm, SnacksForm, 
     Profile, Order, Reservation, Selection
 )
-from .constants import WEEKDAYS
+from .constants import (
+    WEEKDAYS, WEEKDAY_CHOICES, WEEKDAY_NAMES, ADMIN_UPDATE_BATCH_SIZE
+)
 
 
 class DateInput(forms.DateInput):
@@ -31,72 +38,118 @@ class FormAdminArea(admin.AdminSite):
 form_site = FormAdminArea(name="FormAdmin")
 
 
+class FoodItemAutocomplete(AutocompleteSelectMultiple):
+    """
+    AJAX food item picker that only renders the selected items and only
+    suggests items of the given food type
+    """
+
+    def __init__(self, food_type=None, attrs=None):
+        super().__init__(Option._meta.get_field('food_items'), form_site, attrs=attrs)
+        self.food_type = food_type
+
+    def get_url(self):
+        """Pass the food type along to FoodItemAdmin.get_search_results"""
+        url = super().get_url()
+        if self.food_type:
+            url = f"{url}?food_type={self.food_type}"
+        return url
+
+
+def weekday_food_items_field():
+    """A weekday's food item picker; BaseWeeklyForm sets its queryset and widget"""
+    return forms.ModelMultipleChoiceField(
+        queryset=FoodItem.objects.none(),
+        required=False
+    )
+
+
 class BaseWeeklyForm(forms.ModelForm):
     """
     Base form class for weekly forms (lunch/snacks) to reduce code duplication
     """
+    food_type = None
+
+    # Declared on the class so the admin fieldsets can name them
+    monday = weekday_food_items_field()
+    tuesday = weekday_food_items_field()
+    wednesday = weekday_food_items_field()
+    thursday = weekday_food_items_field()
+    friday = weekday_food_items_field()
     
     def __init__(self, *args, **kwargs):
         super(BaseWeeklyForm, self).__init__(*args, **kwargs)
         
-        # Initialize weekday fields with proper food type filtering
-        for weekday_name in WEEKDAYS.values():
-            field_name = weekday_name
-            self.fields[field_name] = forms.ModelMultipleChoiceField(
-                required=False,
-                widget=FilteredSelectMultiple("Food Items", is_stacked=False),
-                queryset=self._get_food_items_queryset()
-            )
+        # Narrow the weekday fields to this form's food type. The queryset
+        # and widget are built once; each field gets its own widget copy.
+        food_items_queryset = self._get_food_items_queryset()
+        food_items_widget = FoodItemAutocomplete(self.food_type)
+        for weekday_name in WEEKDAY_NAMES:
+            field = self.fields[weekday_name]
+            field.widget = copy.deepcopy(food_items_widget)
+            field.queryset = food_items_queryset
         
-        # Populate initial data if editing existing instance
-        if hasattr(self, 'instance') and self.instance.pk:
-            self._populate_initial_data()
+        self._populate_initial_data()
 
     def _get_food_items_queryset(self):
-        """Override in subclasses to filter by food type"""
+        """Food items allowed for this form, filtered by food_type if set"""
+        if self.food_type:
+            return FoodItem.objects.filter(type=self.food_type)
         return FoodItem.objects.all()
     
     def _populate_initial_data(self):
         """Populate form with existing option data"""
-        for option in self.instance.options.all():
+        # An unsaved form has no options, skip the query on the add page
+        if not self.instance.pk:
+            return
+
+        for option in self.instance.options.prefetch_related('food_items'):
             weekday_name = WEEKDAYS.get(option.weekday)
             if weekday_name:
-                self.initial[weekday_name] = option.food_items.all()
+                self.initial[weekday_name] = [
+                    food_item.pk for food_item in option.food_items.all()
+                ]
 
     class Meta:
         widgets = {
             'week': DateInput(),
         }
-        exclude = ('created_at', 'options')
-
-    def save(self, commit=True):
-        """Save form and create/update options for each weekday"""
-        form_instance = super().save(commit)
-        
-        for weekday_num, weekday_name in WEEKDAYS.items():
-            selected_items = self.cleaned_data.get(weekday_name, [])
-            
-            # Get or create option for this weekday
-            option, created = Option.objects.get_or_create(
-                weekday=weekday_num,
-                defaults={'weekday': weekday_num}
+        exclude = ('created_at',)
+
+    def _save_m2m(self):
+        """
+        Save many-to-many data, then create/update options for each weekday.
+        Runs from save() or, when the admin saves with commit=False, from
+        save_m2m() once the form instance has a primary key.
+        """
+        super()._save_m2m()
+        form_instance = self.instance
+
+        # Fetch this form's existing options once, keyed by weekday
+        options = {option.weekday: option for option in form_instance.options.all()}
+
+        # Only a brand new form is missing options. Conflicts with an option
+        # created by a concurrent save are ignored, and since MySQL's
+        # bulk_create does not return primary keys, the options are re-read.
+        missing = [
+            Option(form=form_instance, weekday=weekday_num)
+            for weekday_num in WEEKDAYS
+            if weekday_num not in options
+        ]
+        if missing:
+            Option.objects.bulk_create(missing, ignore_conflicts=True)
+            options = {option.weekday: option for option in form_instance.options.all()}
+
+        # set() writes the M2M rows itself, no option.save() needed
+        for weekday_num, weekday_name in WEEKDAY_CHOICES:
+            options[weekday_num].food_items.set(
+                self.cleaned_data.get(weekday_name, [])
             )
-            
-            # Update food items for this option
-            option.food_items.set(selected_items)
-            option.save()
-            
-            # Add option to form if not already added
-            form_instance.options.add(option)
-        
-        return form_instance
 
 
 class NewLunchForm(BaseWeeklyForm):
     """Form for creating/editing lunch forms"""
-    
-    def _get_food_items_queryset(self):
-        return FoodItem.objects.filter(type=FoodItem.LUNCH)
+    food_type = FoodItem.LUNCH
 
     class Meta(BaseWeeklyForm.Meta):
         model = LunchForm
@@ -104,98 +157,146 @@ class NewLunchForm(BaseWeeklyForm):
 
 class NewSnacksForm(BaseWeeklyForm):
     """Form for creating/editing snacks forms"""
-    
-    def _get_food_items_queryset(self):
-        return FoodItem.objects.filter(type=FoodItem.SNACKS)
+    food_type = FoodItem.SNACKS
 
     class Meta(BaseWeeklyForm.Meta):
         model = SnacksForm
 
 
 # Admin Actions
+def _get_single_selected_id(request, queryset, error_message):
+    """
+    Return the id of the only selected object, or report an error and
+    return None. Fetching at most two ids avoids a COUNT over the selection.
+    """
+    selected_ids = list(queryset.values_list('pk', flat=True)[:2])
+    if len(selected_ids) != 1:
+        messages.error(request, error_message)
+        return None
+    return selected_ids[0]
+
+
 @admin.action(description="Print orders for selected forms")
 def print_orders(modeladmin, request, queryset):
     """Print orders for kitchen preparation"""
-    if queryset.count() > 1:
-        messages.error(request, "You can only print orders for 1 form at a time.")
+    form_id = _get_single_selected_id(
+        request, queryset, "You can only print orders for 1 form at a time."
+    )
+    if form_id is None:
         return
     
-    form_id = queryset.first().id
     return redirect(f'/admin/print_form/{form_id}')
 
 
 @admin.action(description="Check quantities for selected forms")
 def check_quantities(modeladmin, request, queryset):
     """Check quantities needed for food preparation"""
-    if queryset.count() > 1:
-        messages.error(request, "You can only check quantities for 1 form at a time.")
+    form_id = _get_single_selected_id(
+        request, queryset, "You can only check quantities for 1 form at a time."
+    )
+    if form_id is None:
         return
     
-    form_id = queryset.first().id
     return redirect(f'/admin/check_quantities/{form_id}')
 
 
-@admin.action(description="Mark orders as paid")
-def set_paid(modeladmin, request, queryset):
-    """Mark selected orders as paid"""
-    count = queryset.update(paid=True)
-    messages.success(request, f"{count} orders marked as paid.")
+def _make_set_paid_action(paid):
+    """Build an admin action that marks the selected orders as paid/unpaid"""
+    label = "paid" if paid else "unpaid"
+
+    @admin.action(description=f"Mark orders as {label}")
+    def set_paid_action(modeladmin, request, queryset):
+        """Update the selected orders in batches inside one transaction"""
+        order_ids = list(queryset.values_list('pk', flat=True))
+        count = 0
+        with transaction.atomic():
+            for start in range(0, len(order_ids), ADMIN_UPDATE_BATCH_SIZE):
+                batch = order_ids[start:start + ADMIN_UPDATE_BATCH_SIZE]
+                count += Order.objects.filter(pk__in=batch).update(paid=paid)
+        messages.success(request, f"{count} orders marked as {label}.")
+
+    set_paid_action.__name__ = f"set_{label}"
+    return set_paid_action
 
 
-@admin.action(description="Mark orders as unpaid")
-def set_unpaid(modeladmin, request, queryset):
-    """Mark selected orders as unpaid"""
-    count = queryset.update(paid=False)
-    messages.success(request, f"{count} orders marked as unpaid.")
+set_paid = _make_set_paid_action(True)
+set_unpaid = _make_set_paid_action(False)
 
 
 @admin.action(description="Check order details")
 def check_order(modeladmin, request, queryset):
     """View detailed order information"""
-    if queryset.count() > 1:
-        messages.error(request, "You can only check 1 order at a time.")
+    order_id = _get_single_selected_id(
+        request, queryset, "You can only check 1 order at a time."
+    )
+    if order_id is None:
         return
     
-    order_id = queryset.first().id
     return redirect(f'/admin/check_order/{order_id}')
 
 
 # Admin Classes
-class LunchFormAdmin(admin.ModelAdmin):
-    """Admin interface for lunch forms"""
-    form = NewLunchForm
-    list_display = ["display_week", "active", "get_total_orders", "id"]
-    list_filter = ["active", "created_at"]
-    search_fields = ["week"]
-    actions = [print_orders, check_quantities]
-    
-    fieldsets = (
+class OnlyFieldsChangeList(ChangeList):
+    """Changelist that only loads the columns named by the model admin"""
+
+    def get_queryset(self, request, *args, **kwargs):
+        queryset = super().get_queryset(request, *args, **kwargs)
+        return queryset.only(*self.model_admin.changelist_only_fields)
+
+
+class OnlyFieldsAdminMixin:
+    """
+    Load just `changelist_only_fields` on the changelist page. The change
+    view still loads full rows, so editing never hits deferred fields.
+    """
+    changelist_only_fields = ()
+
+    def get_changelist(self, request, **kwargs):
+        return OnlyFieldsChangeList
+
+
+def weekly_form_fieldsets(menu_description):
+    """Build the fieldsets shared by the weekly lunch/snacks form admins"""
+    return (
         ("Basic Information", {
             "fields": ("week", "active")
         }),
         ("Weekly Menu", {
-            "fields": tuple(WEEKDAYS.values()),
-            "description": "Select food items available for each day of the week."
+            "fields": WEEKDAY_NAMES,
+            "description": menu_description
         }),
     )
 
 
-class SnacksFormAdmin(admin.ModelAdmin):
-    """Admin interface for snacks forms"""
-    form = NewSnacksForm
+class WeeklyFormAdmin(OnlyFieldsAdminMixin, admin.ModelAdmin):
+    """
+    Base admin for weekly forms (lunch/snacks) to reduce code duplication
+    """
+    changelist_only_fields = ("week", "active", "created_at")
     list_display = ["display_week", "active", "get_total_orders", "id"]
     list_filter = ["active", "created_at"]
     search_fields = ["week"]
     actions = [print_orders, check_quantities]
-    
-    fieldsets = (
-        ("Basic Information", {
-            "fields": ("week", "active")
-        }),
-        ("Weekly Menu", {
-            "fields": tuple(WEEKDAYS.values()),
-            "description": "Select snack items available for each day of the week."
-        }),
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        """Annotate order counts so the changelist doesn't count per row"""
+        return super().get_queryset(request).annotate(_total_orders=Count('order'))
+
+
+class LunchFormAdmin(WeeklyFormAdmin):
+    """Admin interface for lunch forms"""
+    form = NewLunchForm
+    fieldsets = weekly_form_fieldsets(
+        "Select food items available for each day of the week."
+    )
+
+
+class SnacksFormAdmin(WeeklyFormAdmin):
+    """Admin interface for snacks forms"""
+    form = NewSnacksForm
+    fieldsets = weekly_form_fieldsets(
+        "Select snack items available for each day of the week."
     )
 
 
@@ -216,10 +317,21 @@ class FoodItemAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        """Limit weekly form autocomplete suggestions to one food type"""
+        queryset, may_have_duplicates = super().get_search_results(
+            request, queryset, search_term
+        )
+        food_type = request.GET.get("food_type")
+        if food_type:
+            queryset = queryset.filter(type=food_type)
+        return queryset, may_have_duplicates
+
 
 class ProfileAdmin(admin.ModelAdmin):
     """Admin interface for user profiles"""
     list_display = ["name", "user", "role", "department", "coins", "get_total_orders", "get_unpaid_orders"]
+    list_select_related = ["user"]
     list_filter = ["role", "department"]
     search_fields = ["name", "user__email"]
     ordering = ["name"]
@@ -237,6 +349,13 @@ class ProfileAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        """Annotate order counts so the changelist doesn't count per row"""
+        return super().get_queryset(request).annotate(
+            _total_orders=Count('order'),
+            _unpaid_orders=Count('order', filter=Q(order__paid=False)),
+        )
+
 
 class FormNameListFilter(admin.SimpleListFilter):
     """Filter orders by form week"""
@@ -245,7 +364,8 @@ class FormNameListFilter(admin.SimpleListFilter):
 
     def lookups(self, request, model_admin):
         """Get all unique form weeks for filtering"""
-        forms = set(order.form for order in model_admin.model.objects.all())
+        form_ids = model_admin.model.objects.values('form')
+        forms = Form.objects.filter(pk__in=form_ids).only('pk', 'week')
         return [(form.week, str(form)) for form in forms]
 
     def queryset(self, request, queryset):
@@ -255,7 +375,15 @@ class FormNameListFilter(admin.SimpleListFilter):
         return queryset
 
 
-class OrderAdmin(admin.ModelAdmin):
+class ReservationInline(admin.TabularInline):
+    """Daily reservations shown on the order change page"""
+    model = Reservation
+    fields = ["weekday", "paid", "subtotal"]
+    readonly_fields = ["subtotal"]
+    extra = 0
+
+
+class OrderAdmin(OnlyFieldsAdminMixin, admin.ModelAdmin):
     """Admin interface for orders"""
     list_display = [
         "id", "display_user", "display_order_type", 
@@ -265,24 +393,34 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ["profile__name", "profile__user__email"]
     actions = [set_paid, set_unpaid, check_order]
     ordering = ["-created_at"]
+    # The lunchform/snacksform joins let Form.display_type() resolve the
+    # form type without a query per row
+    list_select_related = ["profile", "form__lunchform", "form__snacksform"]
+    changelist_only_fields = (
+        "id", "paid", "total_paid", "created_at", "profile__name", "form__week",
+        "form__lunchform__form_ptr", "form__snacksform__form_ptr"
+    )
     
     fieldsets = (
         ("Order Information", {
             "fields": ("profile", "form", "total_paid", "paid")
         }),
-        ("Reservations", {
-            "fields": ("reservations",),
-            "description": "Daily reservations included in this order"
-        }),
     )
     
-    filter_horizontal = ["reservations"]
+    inlines = [ReservationInline]
+
+    def get_queryset(self, request):
+        """Annotate reservation counts so the changelist doesn't count per row"""
+        return super().get_queryset(request).annotate(
+            _reservation_count=Count('reservations')
+        )
 
 
 class ReservationAdmin(admin.ModelAdmin):
     """Admin interface for reservations"""
     list_display = ["__str__", "weekday", "paid", "get_total_amount"]
     list_filter = ["weekday", "paid"]
+    readonly_fields = ["subtotal"]
     ordering = ["weekday"]
 
 
@@ -291,6 +429,7 @@ class SelectionAdmin(admin.ModelAdmin):
     list_display = ["__str__", "food_item", "quantity", "line_total"]
     list_filter = ["food_item__type", "reservation__weekday"]
     search_fields = ["food_item__name"]
+    list_select_related = ["food_item"]
 
 
 # Register models with custom admin site
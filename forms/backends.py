@@ -0,0 +1,21 @@
+"""
+Authentication backends for the CCL Reservation System
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+User = get_user_model()
+
+
+class ProfileModelBackend(ModelBackend):
+    """
+    ModelBackend that loads the user's profile in the same query, so
+    request.user.profile costs nothing on every authenticated request
+    """
+
+    def get_user(self, user_id):
+        try:
+            user = User._default_manager.select_related('profile').get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -1,25 +1,22 @@
 # Constants for the reservation system
 
-# Weekdays mapping
-WEEKDAYS = {
-    "1": "monday",
-    "2": "tuesday", 
-    "3": "wednesday",
-    "4": "thursday",
-    "5": "friday"
-}
-
+# Weekdays as (number, name) pairs, in order
 WEEKDAY_CHOICES = (
-    ("1", "monday"),
-    ("2", "tuesday"),
-    ("3", "wednesday"),
-    ("4", "thursday"),
-    ("5", "friday"),
+    (1, "monday"),
+    (2, "tuesday"),
+    (3, "wednesday"),
+    (4, "thursday"),
+    (5, "friday"),
 )
 
+# Weekdays mapping, derived once at import
+WEEKDAYS = dict(WEEKDAY_CHOICES)
+WEEKDAY_NAMES = tuple(name for _, name in WEEKDAY_CHOICES)
+
 # Payment constants
 PAYMONGO_SERVICE_FEE_RATE = 0.025
 PESO_TO_CENTAVOS_MULTIPLIER = 100
+PAYMONGO_PAYMENT_PAID_EVENT = "checkout_session.payment.paid"
 
 # OAuth scopes
 MICROSOFT_OAUTH_SCOPES = ["User.Read", "profile", "email", "openid"]
@@ -34,4 +31,22 @@ MICROSOFT_GRAPH_USER_URL = "https://graph.microsoft.com/v1.0/me?$select=displayN
 PAYMONGO_CHECKOUT_URL = "https://api.paymongo.com/v1/checkout_sessions"
 
 # Random password length
-RANDOM_PASSWORD_LENGTH = 32 
\ No newline at end of file
+RANDOM_PASSWORD_LENGTH = 32 
+
+# Rows per UPDATE statement for bulk admin actions
+ADMIN_UPDATE_BATCH_SIZE = 1000
+
+# Outgoing HTTP connection pooling (Microsoft Graph, PayMongo)
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 20
+HTTP_MAX_RETRIES = 3
+
+# Seconds the active lunch/snacks form lookup stays cached
+ACTIVE_FORM_CACHE_TIMEOUT = 60
+
+# Seconds a user's rendered order history stays cached
+ORDER_HISTORY_CACHE_TIMEOUT = 300
+
+# Reservations rendered per chunk of the streamed print form (a multiple of
+# three keeps the three-column card grid unbroken between chunks)
+PRINT_FORM_BATCH_SIZE = 300
@@ -0,0 +1,25 @@
+"""
+Fill in stored subtotals for reservations created before the column existed
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from forms.models import Reservation, Selection
+
+
+class Command(BaseCommand):
+    help = "Backfill Reservation.subtotal from each reservation's selections"
+
+    def handle(self, *args, **options):
+        # One UPDATE with a correlated subquery instead of a save per row
+        subtotals = Selection.objects.filter(
+            reservation=OuterRef('pk')
+        ).values('reservation').annotate(
+            total=Sum(F('quantity') * F('food_item__price'))
+        ).values('total')
+
+        updated = Reservation.objects.filter(subtotal=0).update(
+            subtotal=Coalesce(Subquery(subtotals), 0)
+        )
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {updated} reservation subtotals"))
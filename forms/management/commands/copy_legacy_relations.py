@@ -0,0 +1,90 @@
+"""
+Copy links from the old many-to-many tables into the new ForeignKeys
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from forms.models import Form, Option, Order, Reservation
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy Form.options links into Option.form and Order.reservations "
+        "links into Reservation.order. Run after migrating to the migration "
+        "that adds the new columns, before the one that drops the old join "
+        "tables."
+    )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        tables = connection.introspection.table_names()
+
+        form_options_table = f"{Form._meta.db_table}_options"
+        if form_options_table in tables:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT form_id, option_id FROM {form_options_table} "
+                    f"ORDER BY option_id, form_id"
+                )
+                links = cursor.fetchall()
+
+            claimed, cloned = self.copy_form_options(links)
+            self.stdout.write(self.style.SUCCESS(
+                f"Linked {claimed} options to their form, cloned {cloned} shared options"
+            ))
+        else:
+            self.stdout.write(f"{form_options_table} does not exist, skipping options")
+
+        order_reservations_table = f"{Order._meta.db_table}_reservations"
+        if order_reservations_table in tables:
+            linked = self.copy_order_reservations(order_reservations_table)
+            self.stdout.write(self.style.SUCCESS(
+                f"Linked {linked} reservations to their order"
+            ))
+        else:
+            self.stdout.write(f"{order_reservations_table} does not exist, skipping reservations")
+
+    @staticmethod
+    def copy_form_options(links):
+        """
+        Options used to be shared between forms. The first form keeps the
+        option; every other form gets its own copy with the same food items.
+        """
+        option_ids = {option_id for _, option_id in links}
+        options = Option.objects.prefetch_related('food_items').in_bulk(option_ids)
+        taken = set(Option.objects.filter(form__isnull=False).values_list('form_id', 'weekday'))
+        claimed = cloned = 0
+
+        for form_id, option_id in links:
+            option = options[option_id]
+            if (form_id, option.weekday) in taken:
+                continue  # The unique (form, weekday) constraint keeps the first
+            taken.add((form_id, option.weekday))
+
+            if option.form_id is None:
+                option.form_id = form_id
+                option.save(update_fields=['form'])
+                claimed += 1
+            elif option.form_id != form_id:
+                copy = Option.objects.create(form_id=form_id, weekday=option.weekday)
+                copy.food_items.set(option.food_items.all())
+                cloned += 1
+
+        return claimed, cloned
+
+    @staticmethod
+    def copy_order_reservations(order_reservations_table):
+        """
+        Each reservation belonged to one order, so the link is copied with a
+        single UPDATE instead of a save per reservation
+        """
+        reservation_table = Reservation._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {reservation_table} SET order_id = ("
+                f"SELECT MIN(link.order_id) FROM {order_reservations_table} link "
+                f"WHERE link.reservation_id = {reservation_table}.id"
+                f") WHERE order_id IS NULL AND id IN ("
+                f"SELECT reservation_id FROM {order_reservations_table})"
+            )
+            return cursor.rowcount
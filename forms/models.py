@@ -3,13 +3,33 @@ Django models for the CCL Reservation System
 """
 import datetime
 from datetime import timedelta
+from functools import lru_cache
 from django.db import models
+from django.db.models import F, Sum
 from django.contrib.auth.models import User
 from django.utils.html import format_html
 
 from .constants import WEEKDAY_CHOICES
 
 
+@lru_cache(maxsize=512)
+def format_week(week_string):
+    """
+    Format a week identifier (e.g., 2024-W01) as a date range. Cached
+    because the same few weeks are formatted for every order listed.
+    """
+    try:
+        year = int(week_string.split("-")[0])
+        week = int(week_string.split("W")[-1])
+
+        start_date = datetime.date.fromisocalendar(year, week, 1)
+        end_date = start_date + timedelta(days=6)
+
+        return f"{start_date.strftime('%b %d, %Y')} - {end_date.strftime('%b %d, %Y')}"
+    except (ValueError, IndexError):
+        return week_string
+
+
 class FoodItem(models.Model):
     """
     Represents a food item that can be ordered (lunch or snacks)
@@ -50,14 +70,20 @@ class FoodItem(models.Model):
 
 class Option(models.Model):
     """
-    Represents food options available for a specific weekday
+    Represents food options available on a form for a specific weekday
     """
+    form = models.ForeignKey(
+        "Form",
+        on_delete=models.CASCADE,
+        null=True,
+        related_name="options",
+        help_text="The form this option belongs to"
+    )
     food_items = models.ManyToManyField(
         FoodItem, 
         help_text="Food items available for this day"
     )
-    weekday = models.CharField(
-        max_length=3, 
+    weekday = models.SmallIntegerField(
         choices=WEEKDAY_CHOICES,
         help_text="Day of the week"
     )
@@ -66,6 +92,12 @@ class Option(models.Model):
         ordering = ['weekday']
         verbose_name = "Daily Option"
         verbose_name_plural = "Daily Options"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['form', 'weekday'],
+                name='uniq_option_form_weekday'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.get_weekday_display().title()} Options"
@@ -75,15 +107,26 @@ class Reservation(models.Model):
     """
     Represents food reservations for a specific weekday
     """
-    weekday = models.CharField(
-        max_length=3, 
+    order = models.ForeignKey(
+        "Order",
+        on_delete=models.CASCADE,
+        null=True,
+        related_name="reservations",
+        help_text="The order this reservation belongs to"
+    )
+    weekday = models.SmallIntegerField(
         choices=WEEKDAY_CHOICES,
+        db_index=True,
         help_text="Day of the week for this reservation"
     )
     paid = models.BooleanField(
         default=False,
         help_text="Whether this reservation has been paid for"
     )
+    subtotal = models.IntegerField(
+        default=0,
+        help_text="Total amount for this reservation in PHP"
+    )
 
     class Meta:
         ordering = ['weekday']
@@ -91,11 +134,17 @@ class Reservation(models.Model):
         verbose_name_plural = "Daily Reservations"
 
     def get_total_amount(self):
-        """Calculate total amount for this reservation"""
-        return sum(
-            selection.line_total() 
-            for selection in self.selection_set.all()
-        )
+        """
+        Get total amount for this reservation, stored when it was created.
+        Falls back to the selections for rows not yet backfilled.
+        """
+        return self.subtotal or self.calculate_subtotal()
+
+    def calculate_subtotal(self):
+        """Recalculate the subtotal from this reservation's selections"""
+        return self.selection_set.aggregate(
+            total=Sum(F('quantity') * F('food_item__price'))
+        )['total'] or 0
 
     def __str__(self):
         return f"{self.get_weekday_display().title()} Reservation"
@@ -139,7 +188,7 @@ class Form(models.Model):
     Base class for weekly food forms (lunch or snacks)
     """
     created_at = models.DateTimeField(
-        default=datetime.datetime.now,
+        auto_now_add=True,
         help_text="When this form was created"
     )
     active = models.BooleanField(
@@ -148,30 +197,22 @@ class Form(models.Model):
     )
     week = models.CharField(
         max_length=50,
+        db_index=True,
         help_text="Week identifier (e.g., 2024-W01)"
     )
-    options = models.ManyToManyField(
-        Option,
-        help_text="Food options available for each day of the week"
-    )
 
     class Meta:
         ordering = ['-week']
         verbose_name = "Food Form"
         verbose_name_plural = "Food Forms"
+        indexes = [
+            models.Index(fields=['-created_at']),
+            models.Index(fields=['active', '-created_at']),
+        ]
 
     def display_week(self):
         """Format week string for display"""
-        try:
-            year = int(self.week.split("-")[0])
-            week = int(self.week.split("W")[-1])
-
-            start_date = datetime.date.fromisocalendar(year, week, 1)
-            end_date = start_date + timedelta(days=6)
-
-            return f"{start_date.strftime('%b %d, %Y')} - {end_date.strftime('%b %d, %Y')}"
-        except (ValueError, IndexError):
-            return self.week
+        return format_week(self.week)
     display_week.short_description = 'Week Period'
 
     def display_type(self):
@@ -186,6 +227,8 @@ class Form(models.Model):
 
     def get_total_orders(self):
         """Get count of orders for this form"""
+        if hasattr(self, '_total_orders'):
+            return self._total_orders
         return self.order_set.count()
     get_total_orders.short_description = 'Total Orders'
 
@@ -258,17 +301,23 @@ class Profile(models.Model):
         verbose_name_plural = "User Profiles"
 
     def add_coins(self, amount):
-        """Add coins to the user's account"""
-        self.coins += amount
-        self.save()
+        """
+        Add coins to the user's account with an atomic UPDATE. The in-memory
+        `coins` value is not refreshed; call refresh_from_db() if needed.
+        """
+        Profile.objects.filter(pk=self.pk).update(coins=F('coins') + amount)
 
     def get_total_orders(self):
         """Get total number of orders placed by this user"""
+        if hasattr(self, '_total_orders'):
+            return self._total_orders
         return self.order_set.count()
     get_total_orders.short_description = 'Total Orders'
 
     def get_unpaid_orders(self):
         """Get number of unpaid orders"""
+        if hasattr(self, '_unpaid_orders'):
+            return self._unpaid_orders
         return self.order_set.filter(paid=False).count()
     get_unpaid_orders.short_description = 'Unpaid Orders'
 
@@ -280,11 +329,6 @@ class Order(models.Model):
     """
     Represents a complete weekly food order
     """
-    reservations = models.ManyToManyField(
-        Reservation, 
-        related_name="order",
-        help_text="Daily reservations included in this order"
-    )
     form = models.ForeignKey(
         Form, 
         on_delete=models.CASCADE,
@@ -297,6 +341,7 @@ class Order(models.Model):
     )
     paid = models.BooleanField(
         default=False,
+        db_index=True,
         help_text="Whether this order has been fully paid"
     )
     total_paid = models.IntegerField(
@@ -324,6 +369,11 @@ class Order(models.Model):
         ordering = ['-created_at']
         verbose_name = "Food Order"
         verbose_name_plural = "Food Orders"
+        indexes = [
+            models.Index(fields=['form', 'profile']),
+            models.Index(fields=['form', 'paid']),
+            models.Index(fields=['profile', 'paid']),
+        ]
 
     def display_user(self):
         """Get user's name for display"""
@@ -337,6 +387,8 @@ class Order(models.Model):
 
     def get_reservation_count(self):
         """Get number of daily reservations in this order"""
+        if hasattr(self, '_reservation_count'):
+            return self._reservation_count
         return self.reservations.count()
     get_reservation_count.short_description = 'Days Ordered'
 
@@ -1,25 +1,50 @@
 """
 Service classes for handling business logic
 """
-import random
-import string
 import base64
+import json
+import secrets
 import requests
+from requests.adapters import HTTPAdapter
 from requests_oauthlib import OAuth2Session
+from urllib3.util.retry import Retry
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Sum
 
 from .models import Profile, Order, Reservation, Selection, FoodItem
 from .constants import (
     MICROSOFT_OAUTH_SCOPES, ALLOWED_EMAIL_DOMAIN, RANDOM_PASSWORD_LENGTH,
     MICROSOFT_AUTH_BASE_URL, MICROSOFT_TOKEN_URL, MICROSOFT_GRAPH_USER_URL,
     PAYMONGO_CHECKOUT_URL, PAYMONGO_SERVICE_FEE_RATE, PESO_TO_CENTAVOS_MULTIPLIER,
-    WEEKDAYS
+    WEEKDAYS, WEEKDAY_NAMES, HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, HTTP_MAX_RETRIES,
+    ACTIVE_FORM_CACHE_TIMEOUT
 )
 
 User = get_user_model()
 
 
+def build_http_session():
+    """
+    Create a requests session whose pooled HTTPS connections stay alive
+    between calls. Only idempotent requests are retried.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=Retry(
+            total=HTTP_MAX_RETRIES,
+            backoff_factor=0.3,
+            status_forcelist=[502, 503, 504]
+        )
+    )
+    session.mount("https://", adapter)
+    return session
+
+
 class MicrosoftOAuthService:
     """Handles Microsoft OAuth authentication"""
     
@@ -27,6 +52,7 @@ class MicrosoftOAuthService:
         self.client_id = client_id
         self.client_secret = client_secret
         self.host_url = host_url
+        self._session = build_http_session()
     
     def get_oauth_session(self):
         """Initialize OAuth2 session"""
@@ -53,8 +79,8 @@ class MicrosoftOAuthService:
         )
         
         headers = {"Authorization": f"Bearer {token['access_token']}"}
-        response = requests.get(MICROSOFT_GRAPH_USER_URL, headers=headers)
-        return response.json()
+        response = self._session.get(MICROSOFT_GRAPH_USER_URL, headers=headers)
+        return json.loads(response.content)
 
 
 class UserService:
@@ -62,8 +88,8 @@ class UserService:
     
     @staticmethod
     def is_allowed_email(email):
-        """Check if email domain is allowed"""
-        return email.split('@')[1] == ALLOWED_EMAIL_DOMAIN
+        """Check if email domain is allowed (case-insensitive)"""
+        return email.casefold().endswith(f"@{ALLOWED_EMAIL_DOMAIN.casefold()}")
     
     @staticmethod
     def create_user_from_oauth(user_data):
@@ -73,10 +99,7 @@ class UserService:
         if not UserService.is_allowed_email(email):
             return None
             
-        random_password = "".join(
-            random.choice(string.ascii_letters) 
-            for _ in range(RANDOM_PASSWORD_LENGTH)
-        )
+        random_password = secrets.token_urlsafe(RANDOM_PASSWORD_LENGTH)
         
         user = User(
             username=email, 
@@ -102,14 +125,24 @@ class PaymentService:
     def __init__(self, secret_key, host_url):
         self.secret_key = secret_key
         self.host_url = host_url
-    
-    def _get_headers(self):
-        """Get PayMongo API headers"""
-        base64_secret = base64.b64encode(self.secret_key.encode("ascii")).decode("ascii")
-        return {
+        self._session = build_http_session()
+        
+        # Every PayMongo call uses the same headers, so the session sends them
+        base64_secret = base64.b64encode(secret_key.encode("ascii")).decode("ascii")
+        self._session.headers.update({
             "accept": "application/json",
             "authorization": f"Basic {base64_secret}",
             "content-type": "application/json"
+        })
+        
+        # Checkout attributes that are the same for every session
+        self._checkout_attributes = {
+            "payment_method_types": ["gcash"],
+            "description": "Food Reservation Payment",
+            "send_email_receipt": False,
+            "show_description": True,
+            "show_line_items": True,
+            "success_url": host_url,
         }
     
     def create_checkout_session(self, amount, metadata):
@@ -119,7 +152,7 @@ class PaymentService:
         payload = {
             "data": {
                 "attributes": {
-                    "payment_method_types": ["gcash"],
+                    **self._checkout_attributes,
                     "line_items": [
                         {
                             "amount": amount * PESO_TO_CENTAVOS_MULTIPLIER,
@@ -134,61 +167,101 @@ class PaymentService:
                             "quantity": 1
                         }
                     ],
-                    "description": "Food Reservation Payment",
-                    "send_email_receipt": False,
-                    "show_description": True,
-                    "show_line_items": True,
-                    "success_url": self.host_url,
                     "metadata": metadata
                 }
             }
         }
         
-        response = requests.post(
-            PAYMONGO_CHECKOUT_URL, 
-            json=payload, 
-            headers=self._get_headers()
+        response = self._session.post(PAYMONGO_CHECKOUT_URL, json=payload)
+        return json.loads(response.content)
+
+
+class FormService:
+    """Handles lookups of the weekly forms"""
+    
+    @staticmethod
+    def _active_form_cache_key(model):
+        return f"active_form:{model.__name__}"
+    
+    @staticmethod
+    def get_active_form(model):
+        """Get the active form of the given type (LunchForm or SnacksForm), cached"""
+        return cache.get_or_set(
+            FormService._active_form_cache_key(model),
+            lambda: model.objects.filter(active=True).first(),
+            ACTIVE_FORM_CACHE_TIMEOUT
         )
-        return response.json()
+    
+    @staticmethod
+    def clear_active_form_cache(model):
+        """Forget the cached active form so the next lookup hits the database"""
+        cache.delete(FormService._active_form_cache_key(model))
 
 
 class OrderService:
     """Handles order creation and management"""
     
     @staticmethod
+    @transaction.atomic
     def create_order_from_form_data(form_data, active_form, profile):
-        """Create order from form submission data"""
-        order = Order.objects.create(
-            form=active_form, 
-            profile=profile,
-            grade=profile.department or "Unknown",  # Use profile's department as grade
-            name=profile.name    # Use profile's name
-        )
+        """
+        Create order from form submission data. Runs in one transaction so a
+        failure part-way never leaves an order without its reservations.
+        """
         total_paid = 0
         
         # Group food items by weekday
         food_items_by_weekday = OrderService._group_food_items_by_weekday(form_data)
         
-        # Create reservations for each weekday
+        # Fetch every selected food item's price in one query
+        food_item_ids = {
+            food_item_id
+            for food_items in food_items_by_weekday.values()
+            for food_item_id, _ in food_items
+        }
+        food_items_by_id = FoodItem.objects.only('id', 'price').in_bulk(food_item_ids)
+        
+        # Build reservations for each weekday, totalling them as we go
+        reservations = []
+        selections = []
         for weekday_num, food_items in food_items_by_weekday.items():
             if food_items:  # Only create reservation if there are items
-                reservation = Reservation.objects.create(weekday=weekday_num)
+                reservation = Reservation(weekday=weekday_num)
                 
-                for food_item_data in food_items:
-                    food_item = FoodItem.objects.get(id=food_item_data["food_item_id"])
-                    quantity = int(food_item_data["quantity"])
-                    total_paid += food_item.price * quantity
+                for food_item_id, quantity in food_items:
+                    food_item = food_items_by_id[food_item_id]
+                    reservation.subtotal += food_item.price * quantity
                     
-                    Selection.objects.create(
+                    selections.append(Selection(
                         reservation=reservation,
                         food_item=food_item,
                         quantity=quantity
-                    )
+                    ))
                 
-                order.reservations.add(reservation)
+                reservations.append(reservation)
+                total_paid += reservation.subtotal
         
-        order.total_paid = total_paid
-        order.save()
+        # Create the order with its total already known
+        order = Order.objects.create(
+            form=active_form, 
+            profile=profile,
+            total_paid=total_paid,
+            grade=profile.department or "Unknown",  # Use profile's department as grade
+            name=profile.name    # Use profile's name
+        )
+        
+        for reservation in reservations:
+            reservation.order = order
+        
+        # The selections need the reservations' primary keys. MySQL's
+        # bulk_create does not return them, so there the reservations
+        # (at most five) are saved one by one instead
+        if connection.features.can_return_rows_from_bulk_insert:
+            Reservation.objects.bulk_create(reservations)
+        else:
+            for reservation in reservations:
+                reservation.save()
+        Selection.objects.bulk_create(selections)
         
         # Award coins based on total spent (20 coins for every 50 PHP)
         total_coins = (total_paid // 50) * 20
@@ -197,18 +270,50 @@ class OrderService:
         
         return order
     
+    @staticmethod
+    def recalculate_totals(reservation_id):
+        """
+        Recalculate a reservation's stored subtotal and its order's total
+        from the current selections, after they were edited. Paid
+        reservations and orders keep the amount that was charged.
+        """
+        reservation = Reservation.objects.filter(pk=reservation_id).only('order_id', 'paid').first()
+        if reservation is None or reservation.paid:
+            return
+        
+        reservation.subtotal = reservation.calculate_subtotal()
+        reservation.save(update_fields=['subtotal'])
+        
+        if reservation.order_id is not None:
+            OrderService.recalculate_order_total(reservation.order_id)
+    
+    @staticmethod
+    def recalculate_order_total(order_id):
+        """
+        Recalculate an unpaid order's stored total from its reservations' subtotals
+        """
+        total_paid = Reservation.objects.filter(
+            order_id=order_id
+        ).aggregate(total=Sum('subtotal'))['total'] or 0
+        Order.objects.filter(pk=order_id, paid=False).update(total_paid=total_paid)
+    
     @staticmethod
     def _group_food_items_by_weekday(form_data):
-        """Group food items by weekday from form data"""
-        food_items_dict = {"1": [], "2": [], "3": [], "4": [], "5": []}
+        """
+        Group (food_item_id, quantity) pairs by weekday from form data.
+        Quantity fields are named "<food_item_id>-<weekday>-quantity".
+        """
+        food_items_dict = {weekday_num: [] for weekday_num in WEEKDAYS}
         
         for key, value in form_data.items():
-            if "quantity" in key and int(value) != 0:
-                food_item_id, weekday_num, *rest = key.split("-")
-                food_items_dict[weekday_num].append({
-                    "food_item_id": food_item_id, 
-                    "quantity": value
-                })
+            if not key.endswith("-quantity") or value in ("", "0"):
+                continue
+            quantity = int(value)
+            if quantity == 0:
+                continue
+            food_item_id, _, rest = key.partition("-")
+            weekday_num, _, _ = rest.partition("-")
+            food_items_dict[int(weekday_num)].append((int(food_item_id), quantity))
         
         return food_items_dict
 
@@ -219,44 +324,42 @@ class ReportService:
     @staticmethod
     def generate_quantity_report(form):
         """Generate quantity report for food preparation"""
-        orders = Order.objects.filter(form=form)
-        count = {
-            "monday": {},
-            "tuesday": {},
-            "wednesday": {},
-            "thursday": {},
-            "friday": {},
-            "total": {}
-        }
+        count = {weekday_name: {} for weekday_name in WEEKDAY_NAMES}
+        count["total"] = {}
         
-        # Initialize counts
-        for option in form.options.all():
-            weekday_name = WEEKDAYS[option.weekday]
-            for food_item in option.food_items.all():
-                count[weekday_name][food_item.name] = 0
-                if food_item.name not in count["total"]:
-                    count["total"][food_item.name] = 0
+        # Initialize counts for every food item on the menu, in one query
+        menu = (
+            FoodItem.objects
+            .filter(option__form=form)
+            .values_list('option__weekday', 'name')
+            .distinct()
+        )
+        for weekday, food_name in menu:
+            count[WEEKDAYS[weekday]][food_name] = 0
+            count["total"][food_name] = 0
         
-        # Count actual orders
-        for order in orders:
-            for reservation in order.reservations.all():
-                weekday_name = WEEKDAYS[reservation.weekday]
-                for selection in reservation.selection_set.all():
-                    count[weekday_name][selection.food_item.name] += selection.quantity
-                    count["total"][selection.food_item.name] += selection.quantity
+        # Sum ordered quantities per weekday and food item in the database
+        quantities = (
+            Selection.objects
+            .filter(reservation__order__form=form)
+            .values('reservation__weekday', 'food_item__name')
+            .annotate(quantity=Sum('quantity'))
+            .order_by()
+        )
+        for row in quantities:
+            weekday_name = WEEKDAYS[row['reservation__weekday']]
+            food_name = row['food_item__name']
+            count[weekday_name][food_name] = (
+                count[weekday_name].get(food_name, 0) + row['quantity']
+            )
+            count["total"][food_name] = count["total"].get(food_name, 0) + row['quantity']
         
         return count
     
     @staticmethod
     def organize_orders_by_weekday(orders):
         """Organize orders by weekday for display"""
-        display = {
-            "monday": [],
-            "tuesday": [],
-            "wednesday": [],
-            "thursday": [],
-            "friday": []
-        }
+        display = {weekday_name: [] for weekday_name in WEEKDAY_NAMES}
         
         for order in orders:
             for reservation in order.reservations.all():
@@ -0,0 +1,44 @@
+"""
+Signal handlers for the CCL Reservation System
+"""
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import LunchForm, SnacksForm, FoodItem, Reservation, Selection
+from .services import FormService, OrderService
+
+
+@receiver(post_save, sender=LunchForm)
+@receiver(post_delete, sender=LunchForm)
+@receiver(post_save, sender=SnacksForm)
+@receiver(post_delete, sender=SnacksForm)
+def clear_active_form_cache(sender, **kwargs):
+    """Drop the cached active form whenever a form is saved or deleted"""
+    FormService.clear_active_form_cache(sender)
+
+
+def _changed_directly(kwargs, *models):
+    """Whether a signal comes from a save, or from a delete started on one of the given models"""
+    origin = kwargs.get('origin')
+    if origin is None:
+        return True
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return origin_model in models
+
+
+@receiver(post_save, sender=Selection)
+@receiver(post_delete, sender=Selection)
+def update_reservation_totals(sender, instance, **kwargs):
+    """Keep the stored reservation and order totals in step with edited selections"""
+    if _changed_directly(kwargs, Selection, FoodItem):
+        OrderService.recalculate_totals(instance.reservation_id)
+    # Otherwise the reservation itself is being deleted
+
+
+@receiver(post_delete, sender=Reservation)
+def update_order_total(sender, instance, **kwargs):
+    """Keep the stored order total in step when a reservation is deleted"""
+    if instance.order_id is not None and _changed_directly(kwargs, Reservation):
+        OrderService.recalculate_order_total(instance.order_id)
+    # Otherwise the order itself is being deleted
@@ -1,3 +1,373 @@
-from django.test import TestCase
+import json
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth import get_user
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpRequest
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from .management.commands.copy_legacy_relations import Command as CopyLegacyRelations
+from .models import FoodItem, LunchForm, Option, Order, Profile, Reservation, Selection, SnacksForm
+from .services import FormService, OrderService
+
+
+class StoredTotalsTests(TestCase):
+    """Stored reservation subtotals and order totals follow edits and deletes"""
+
+    def setUp(self):
+        user = User.objects.create_user("juan", "juan@cclcentrex.edu.ph")
+        self.profile = Profile.objects.create(user=user, name="Juan Dela Cruz")
+        self.form = LunchForm.objects.create(week="2024-W01", active=True)
+        self.rice = FoodItem.objects.create(name="Rice", price=10)
+        self.adobo = FoodItem.objects.create(name="Adobo", price=40)
+
+        # ₱10 on Monday, ₱40 on Tuesday
+        self.order = OrderService.create_order_from_form_data({
+            f"{self.rice.id}-1-quantity": "1",
+            f"{self.adobo.id}-2-quantity": "1",
+        }, self.form, self.profile)
+        self.monday = self.order.reservations.get(weekday=1)
+        self.tuesday = self.order.reservations.get(weekday=2)
+
+    def assertTotals(self, total_paid, **subtotals):
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_paid, total_paid)
+        for weekday, subtotal in subtotals.items():
+            reservation = getattr(self, weekday)
+            reservation.refresh_from_db()
+            self.assertEqual(reservation.subtotal, subtotal)
+
+    def test_order_created_with_totals(self):
+        self.assertTotals(50, monday=10, tuesday=40)
+
+    def test_edit_selection(self):
+        selection = Selection.objects.get(reservation=self.tuesday)
+        selection.quantity = 2
+        selection.save()
+        self.assertTotals(90, monday=10, tuesday=80)
+
+    def test_delete_selection(self):
+        Selection.objects.get(reservation=self.tuesday).delete()
+        self.assertTotals(10, monday=10, tuesday=0)
+
+    def test_delete_food_item_on_unpaid_order(self):
+        self.adobo.delete()
+        self.assertTotals(10, monday=10, tuesday=0)
+
+    def test_delete_reservation(self):
+        self.tuesday.delete()
+        self.assertTotals(10, monday=10)
+
+    def test_delete_reservations_queryset(self):
+        self.order.reservations.filter(weekday=2).delete()
+        self.assertTotals(10, monday=10)
+
+    def test_paid_order_keeps_charged_totals(self):
+        Order.objects.filter(pk=self.order.pk).update(paid=True)
+        Reservation.objects.update(paid=True)
+
+        selection = Selection.objects.get(reservation=self.monday)
+        selection.quantity = 3
+        selection.save()
+        self.adobo.delete()
+        self.assertTotals(50, monday=10, tuesday=40)
+
+        self.tuesday.delete()
+        self.assertTotals(50, monday=10)
+
+    def test_paid_reservation_keeps_charged_subtotal(self):
+        Reservation.objects.filter(pk=self.monday.pk).update(paid=True)
+
+        Selection.objects.get(reservation=self.monday).delete()
+        Selection.objects.get(reservation=self.tuesday).delete()
+        self.assertTotals(10, monday=10, tuesday=0)
+
+    def test_delete_order(self):
+        self.order.delete()
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Reservation.objects.exists())
+        self.assertFalse(Selection.objects.exists())
+
+
+class BackfillReservationSubtotalsTests(TestCase):
+    """Reservations stored before the subtotal column get it backfilled"""
+
+    def setUp(self):
+        user = User.objects.create_user("juan", "juan@cclcentrex.edu.ph")
+        profile = Profile.objects.create(user=user, name="Juan Dela Cruz")
+        form = LunchForm.objects.create(week="2024-W01", active=True)
+        rice = FoodItem.objects.create(name="Rice", price=10)
+        order = OrderService.create_order_from_form_data({
+            f"{rice.id}-1-quantity": "3",
+        }, form, profile)
+        self.reservation = order.reservations.get()
+        Reservation.objects.update(subtotal=0)
+
+    def test_total_falls_back_to_selections(self):
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.get_total_amount(), 30)
+
+    def test_backfill(self):
+        call_command("backfill_reservation_subtotals", stdout=StringIO())
+        self.reservation.refresh_from_db()
+        self.assertEqual(self.reservation.subtotal, 30)
+
+
+class CopyLegacyRelationsTests(TestCase):
+    """Links in the old many-to-many tables are copied to the new ForeignKeys"""
+
+    def test_shared_option_is_cloned(self):
+        week_one = LunchForm.objects.create(week="2024-W01")
+        week_two = LunchForm.objects.create(week="2024-W02")
+        rice = FoodItem.objects.create(name="Rice", price=10)
+        shared = Option.objects.create(weekday=1)
+        shared.food_items.add(rice)
+
+        links = [(week_one.id, shared.id), (week_two.id, shared.id)]
+        self.assertEqual(CopyLegacyRelations.copy_form_options(links), (1, 1))
+
+        shared.refresh_from_db()
+        self.assertEqual(shared.form_id, week_one.id)
+        copy = week_two.options.get(weekday=1)
+        self.assertEqual(list(copy.food_items.all()), [rice])
+
+        # Running it again changes nothing
+        self.assertEqual(CopyLegacyRelations.copy_form_options(links), (0, 0))
+
+    def test_reservations_linked_to_their_order(self):
+        user = User.objects.create_user("juan", "juan@cclcentrex.edu.ph")
+        profile = Profile.objects.create(user=user, name="Juan Dela Cruz")
+        form = LunchForm.objects.create(week="2024-W01")
+        order = Order.objects.create(form=form, profile=profile)
+        linked = Reservation.objects.create(weekday=1)
+        orphan = Reservation.objects.create(weekday=2)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TABLE forms_order_reservations (order_id integer, reservation_id integer)"
+            )
+            cursor.execute(
+                "INSERT INTO forms_order_reservations VALUES (%s, %s)", [order.id, linked.id]
+            )
+
+        linked_count = CopyLegacyRelations.copy_order_reservations("forms_order_reservations")
+        self.assertEqual(linked_count, 1)
+        self.assertEqual(list(order.reservations.all()), [linked])
+        orphan.refresh_from_db()
+        self.assertIsNone(orphan.order_id)
+
+
+class SessionBackendTests(TestCase):
+    """Sessions from either authentication backend keep the user logged in"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("juan", "juan@cclcentrex.edu.ph")
+
+    def get_session_user(self, backend):
+        self.client.force_login(self.user, backend=backend)
+        request = HttpRequest()
+        request.session = self.client.session
+        return get_user(request)
+
+    def test_profile_backend_session(self):
+        user = self.get_session_user("forms.backends.ProfileModelBackend")
+        self.assertEqual(user, self.user)
+
+    def test_model_backend_session_from_before_deploy(self):
+        user = self.get_session_user("django.contrib.auth.backends.ModelBackend")
+        self.assertEqual(user, self.user)
+
+
+class ReservationSubmissionTests(TestCase):
+    """Submitting the reservation form on the index page"""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user("juan", "juan@cclcentrex.edu.ph")
+        self.profile = Profile.objects.create(user=user, name="Juan Dela Cruz")
+        self.form = LunchForm.objects.create(week="2024-W01", active=True)
+        self.rice = FoodItem.objects.create(name="Rice", price=10)
+        self.client.force_login(user, backend="forms.backends.ProfileModelBackend")
+
+    def submit(self):
+        return self.client.post(reverse("index"), {
+            "form": "lunch_form",
+            f"{self.rice.id}-1-quantity": "1",
+        })
+
+    def test_submission_creates_order(self):
+        self.submit()
+        order = self.profile.order_set.get()
+        self.assertEqual(order.total_paid, 10)
+
+    def test_repeat_submission_rejected(self):
+        self.submit()
+        response = self.submit()
+        self.assertEqual(self.profile.order_set.count(), 1)
+        messages = [str(message) for message in response.wsgi_request._messages]
+        self.assertEqual(messages[-1], "You already submitted for this form.")
+
+    def test_form_deactivated_on_another_worker(self):
+        FormService.get_active_form(LunchForm)
+        # A queryset update sends no post_save, like a save on another process
+        LunchForm.objects.filter(pk=self.form.pk).update(active=False)
+
+        self.submit()
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderHistoryCacheTests(TestCase):
+    """The cached order history on the index page follows order changes"""
+
+    MOBILE_USER_AGENT = (
+        "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 "
+        "(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1"
+    )
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user("juan", "juan@cclcentrex.edu.ph")
+        profile = Profile.objects.create(user=user, name="Juan Dela Cruz")
+        form = LunchForm.objects.create(week="2024-W01", active=True)
+        rice = FoodItem.objects.create(name="Rice", price=10)
+        self.order = OrderService.create_order_from_form_data({
+            f"{rice.id}-1-quantity": "1",
+        }, form, profile)
+        self.client.force_login(user, backend="forms.backends.ProfileModelBackend")
+
+    def get_index(self):
+        return self.client.get(reverse("index"), HTTP_USER_AGENT=self.MOBILE_USER_AGENT)
+
+    def test_edited_selection_shows_new_total(self):
+        self.assertContains(self.get_index(), "₱10<")
+
+        selection = Selection.objects.get()
+        selection.quantity = 3
+        selection.save()
+        self.assertContains(self.get_index(), "₱30<")
+
+
+class WeeklyFormAdminTests(TestCase):
+    """Adding and editing weekly forms through the admin saves their options"""
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_superuser("admin", "admin@cclcentrex.edu.ph", "password")
+        self.client.force_login(user, backend="forms.backends.ProfileModelBackend")
+        self.rice = FoodItem.objects.create(name="Rice", price=10)
+        self.adobo = FoodItem.objects.create(name="Adobo", price=40)
+        self.chips = FoodItem.objects.create(name="Chips", price=20, type=FoodItem.SNACKS)
+
+    def menu(self, form):
+        return {
+            option.weekday: sorted(option.food_items.values_list('name', flat=True))
+            for option in form.options.all()
+        }
+
+    def test_add_lunch_form(self):
+        url = reverse("FormAdmin:forms_lunchform_add")
+        self.assertContains(self.client.get(url), "food_type=LUNCH", count=5)
+
+        response = self.client.post(url, {
+            "week": "2024-W01",
+            "active": "on",
+            "monday": [self.rice.id, self.adobo.id],
+            "wednesday": [self.rice.id],
+        })
+        self.assertEqual(response.status_code, 302)
+
+        form = LunchForm.objects.get()
+        self.assertEqual(self.menu(form), {
+            1: ["Adobo", "Rice"], 2: [], 3: ["Rice"], 4: [], 5: [],
+        })
+
+    def test_change_lunch_form(self):
+        form = LunchForm.objects.create(week="2024-W01")
+        Option.objects.create(form=form, weekday=1).food_items.add(self.rice)
+        url = reverse("FormAdmin:forms_lunchform_change", args=[form.id])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["adminform"].form.initial["monday"], [self.rice.id])
+
+        response = self.client.post(url, {
+            "week": "2024-W01",
+            "tuesday": [self.adobo.id],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.menu(form), {
+            1: [], 2: ["Adobo"], 3: [], 4: [], 5: [],
+        })
+
+    def test_snacks_form_rejects_lunch_items(self):
+        response = self.client.post(reverse("FormAdmin:forms_snacksform_add"), {
+            "week": "2024-W01",
+            "monday": [self.rice.id],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SnacksForm.objects.exists())
+
+
+class PaymentWebhookTests(TestCase):
+    """PayMongo payment webhooks mark reservations and orders as paid"""
+
+    def setUp(self):
+        user = User.objects.create_user("juan", "juan@cclcentrex.edu.ph")
+        profile = Profile.objects.create(user=user, name="Juan Dela Cruz")
+        form = LunchForm.objects.create(week="2024-W01", active=True)
+        rice = FoodItem.objects.create(name="Rice", price=10)
+        self.order = OrderService.create_order_from_form_data({
+            f"{rice.id}-1-quantity": "1",
+            f"{rice.id}-2-quantity": "1",
+        }, form, profile)
+        self.monday = self.order.reservations.get(weekday=1)
+        self.tuesday = self.order.reservations.get(weekday=2)
+
+    def pay(self, payment_type, item_id):
+        payload = {"data": {"attributes": {
+            "type": "checkout_session.payment.paid",
+            "data": {"attributes": {"metadata": {"type": payment_type, "id": item_id}}},
+        }}}
+        response = self.client.post(
+            reverse("webhooks"), json.dumps(payload), content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def assertOrderPaid(self, paid):
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.paid, paid)
+
+    def test_order_paid_after_last_reservation(self):
+        self.pay("reservation", self.monday.id)
+        self.assertOrderPaid(False)
+
+        self.pay("reservation", self.tuesday.id)
+        self.assertOrderPaid(True)
+
+    def test_order_payment(self):
+        self.pay("order", self.order.id)
+        self.assertOrderPaid(True)
+
+
+class GroupFoodItemsByWeekdayTests(SimpleTestCase):
+    """Submitted quantity fields are grouped by weekday"""
+
+    def test_grouping(self):
+        grouped = OrderService._group_food_items_by_weekday({
+            "form": "lunch_form",
+            "csrfmiddlewaretoken": "token",
+            "7-1-quantity": "2",
+            "8-1-quantity": "1",
+            "7-3-quantity": "",
+            "8-3-quantity": "0",
+            "9-5-quantity": "00",
+        })
+        self.assertEqual(grouped, {1: [(7, 2), (8, 1)], 2: [], 3: [], 4: [], 5: []})
+
+    def test_empty_form(self):
+        grouped = OrderService._group_food_items_by_weekday({})
+        self.assertEqual(grouped, {1: [], 2: [], 3: [], 4: [], 5: []})
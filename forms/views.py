@@ -2,37 +2,43 @@
 Refactored views with improved readability and structure
 """
 import json
-from django.http import HttpResponse, HttpResponseRedirect
+import logging
+from itertools import groupby, islice
+from operator import attrgetter
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.contrib.auth import get_user_model, login as auth_login
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
-import environ
+from django.db import transaction
+from django.db.models import Count, Max, Prefetch, Q, Sum
 
-from .models import LunchForm, SnacksForm, Order, Reservation, Form
+from .models import LunchForm, SnacksForm, Order, Reservation, Selection, Form, Profile
 from .services import (
     MicrosoftOAuthService, UserService, PaymentService, 
-    OrderService, ReportService
+    FormService, OrderService, ReportService
+)
+from .constants import (
+    WEEKDAYS, WEEKDAY_NAMES, ORDER_HISTORY_CACHE_TIMEOUT, PRINT_FORM_BATCH_SIZE,
+    PAYMONGO_PAYMENT_PAID_EVENT
 )
-from .constants import WEEKDAYS
-
-# Environment setup
-env = environ.Env()
-PAYMONGO_SECRET_KEY = env("PAYMONGO_SECRET_KEY")
-HOST_URL = env("HOST_URL")
-MICROSOFT_CLIENT_SECRET = env("MICROSOFT_CLIENT_SECRET")
-MICROSOFT_CLIENT_ID = env("MICROSOFT_CLIENT_ID")
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
-# Initialize services
+# Initialize services once per process; credentials come from settings
 oauth_service = MicrosoftOAuthService(
-    MICROSOFT_CLIENT_ID, 
-    MICROSOFT_CLIENT_SECRET, 
-    HOST_URL
+    settings.MICROSOFT_CLIENT_ID, 
+    settings.MICROSOFT_CLIENT_SECRET, 
+    settings.HOST_URL
 )
-payment_service = PaymentService(PAYMONGO_SECRET_KEY, HOST_URL)
+payment_service = PaymentService(settings.PAYMONGO_SECRET_KEY, settings.HOST_URL)
+
+# The paid event type as it appears in a raw webhook body
+PAYMENT_PAID_EVENT_MARKER = f'"{PAYMONGO_PAYMENT_PAID_EVENT}"'.encode()
 
 
 def login(request):
@@ -68,10 +74,11 @@ def callback(request):
                 return redirect('login')
         
         # Log user in
-        auth_login(request, user, backend="django.contrib.auth.backends.ModelBackend")
+        auth_login(request, user, backend="forms.backends.ProfileModelBackend")
         return redirect('index')
         
-    except Exception as e:
+    except Exception:
+        logger.exception("Microsoft OAuth callback failed")
         messages.error(request, "Authentication failed. Please try again.")
         return redirect('login')
 
@@ -81,35 +88,40 @@ def webhooks(request):
     """
     Handle PayMongo payment webhooks
     """
+    # Acknowledge events we don't handle without parsing them
+    if PAYMENT_PAID_EVENT_MARKER not in request.body:
+        return HttpResponse(status=200)
+    
     try:
-        webhook_data = json.loads(request.body.decode("utf-8"))
+        webhook_data = json.loads(request.body)
         event_type = webhook_data["data"]["attributes"]["type"]
         
-        if event_type == "checkout_session.payment.paid":
+        if event_type == PAYMONGO_PAYMENT_PAID_EVENT:
             _handle_payment_success(webhook_data["data"]["attributes"])
             
-    except (KeyError, json.JSONDecodeError) as e:
+    except (KeyError, json.JSONDecodeError):
+        logger.warning("Malformed PayMongo webhook", exc_info=True)
         return HttpResponse(status=400)
     
     return HttpResponse(status=200)
 
 
+@transaction.atomic
 def _handle_payment_success(payment_data):
     """
-    Handle successful payment webhook
+    Handle successful payment webhook. The writes share one transaction so
+    a reservation is never left paid without its order being checked.
     """
     metadata = payment_data["data"]["attributes"]["metadata"]
     payment_type = metadata["type"]
     item_id = metadata["id"]
     
     if payment_type == "order":
-        order = get_object_or_404(Order, id=item_id)
-        order.paid = True
-        order.save()
+        if not Order.objects.filter(id=item_id).update(paid=True):
+            raise Http404("No Order matches the given query.")
     elif payment_type == "reservation":
-        reservation = get_object_or_404(Reservation, id=item_id)
-        reservation.paid = True
-        reservation.save()
+        reservation = get_object_or_404(Reservation.objects.only('order_id'), id=item_id)
+        Reservation.objects.filter(pk=reservation.pk).update(paid=True)
         _check_and_update_order_payment_status(reservation)
 
 
@@ -117,11 +129,10 @@ def _check_and_update_order_payment_status(reservation):
     """
     Check if all reservations in an order are paid and update order status
     """
-    order = reservation.order
-    all_paid = all(res.paid for res in order.reservations.all())
-    if all_paid:
-        order.paid = True
-        order.save()
+    # Only matches while none of the order's reservations are still unpaid
+    Order.objects.filter(
+        pk=reservation.order_id, paid=False
+    ).exclude(reservations__paid=False).update(paid=True)
 
 
 @login_required(login_url='/login')
@@ -134,8 +145,8 @@ def index(request):
         return redirect('login')
     
     profile = request.user.profile
-    active_lunch_form = LunchForm.objects.filter(active=True).first()
-    active_snacks_form = SnacksForm.objects.filter(active=True).first()
+    active_lunch_form = FormService.get_active_form(LunchForm)
+    active_snacks_form = FormService.get_active_form(SnacksForm)
     
     # Handle form submission
     if request.method == "POST":
@@ -153,7 +164,7 @@ def _handle_reservation_submission(request, profile, active_lunch_form, active_s
     """
     Handle reservation form submission
     """
-    form_type = request.POST.getlist("form")[0]
+    form_type = request.POST.get("form")
     
     # Determine which form to use
     if form_type == "lunch_form" and active_lunch_form:
@@ -164,12 +175,27 @@ def _handle_reservation_submission(request, profile, active_lunch_form, active_s
         messages.error(request, "Invalid form submission.")
         return redirect('index')
     
-    # Create order from form data
-    OrderService.create_order_from_form_data(
-        request.POST.dict(), 
-        active_form, 
-        profile
-    )
+    # One transaction for the whole submission; locking the profile row
+    # makes a double-submitted form wait and then see the first order
+    with transaction.atomic():
+        Profile.objects.select_for_update().get(pk=profile.pk)
+        
+        # The active form is cached per process; make sure it wasn't
+        # deactivated by an admin on another worker since
+        if not type(active_form).objects.filter(pk=active_form.pk, active=True).exists():
+            messages.error(request, "This form is no longer accepting orders.")
+            return redirect('index')
+        
+        if profile.order_set.filter(form=active_form).exists():
+            messages.error(request, "You already submitted for this form.")
+            return redirect('index')
+        
+        # Create order from form data
+        OrderService.create_order_from_form_data(
+            request.POST, 
+            active_form, 
+            profile
+        )
     
     messages.success(request, "Your reservation has been submitted successfully!")
     return redirect('index')
@@ -179,23 +205,50 @@ def _prepare_index_context(profile, active_lunch_form, active_snacks_form):
     """
     Prepare context data for index view
     """
+    # Only evaluated when the rendered order history isn't cached
+    orders = (
+        profile.order_set
+        .select_related('form__lunchform', 'form__snacksform')
+        .prefetch_related(
+            Prefetch(
+                'reservations__selection_set',
+                queryset=Selection.objects.select_related('food_item')
+            )
+        )
+        .order_by('-id')
+    )
+    
+    # One query answers the submitted checks and versions the cached
+    # history: it changes whenever an order is placed, deleted, paid or
+    # has its total changed by an edit to its selections
+    summary = profile.order_set.aggregate(
+        count=Count('id'),
+        latest=Max('id'),
+        paid=Count('id', filter=Q(paid=True)),
+        total=Sum('total_paid'),
+        lunch=Count('id', filter=Q(form=active_lunch_form)),
+        snacks=Count('id', filter=Q(form=active_snacks_form)),
+    )
+    
     context = {
         "profile": profile,
-        "orders": profile.order_set.all().order_by('-id'),
+        "orders": orders,
+        "orders_version": f"{summary['count']}-{summary['latest']}-{summary['paid']}-{summary['total']}",
+        "order_history_timeout": ORDER_HISTORY_CACHE_TIMEOUT,
     }
     
     if active_lunch_form:
         context.update({
             "active_lunch_form": active_lunch_form,
-            "lunch_options": active_lunch_form.options.all().order_by("weekday"),
-            "submitted_lunch": profile.order_set.filter(form=active_lunch_form).exists()
+            "lunch_options": active_lunch_form.options.prefetch_related('food_items'),
+            "submitted_lunch": summary["lunch"] > 0
         })
     
     if active_snacks_form:
         context.update({
             "active_snacks_form": active_snacks_form,
-            "snacks_options": active_snacks_form.options.all().order_by("weekday"),
-            "submitted_snacks": profile.order_set.filter(form=active_snacks_form).exists()
+            "snacks_options": active_snacks_form.options.prefetch_related('food_items'),
+            "submitted_snacks": summary["snacks"] > 0
         })
     
     return context
@@ -209,7 +262,7 @@ def delete_order(request, id):
     if request.method != "POST":
         return redirect('index')
     
-    order = get_object_or_404(Order, id=id)
+    order = get_object_or_404(Order.objects.only('paid'), id=id)
     
     if not order.paid:
         order.delete()
@@ -242,7 +295,7 @@ def _handle_order_payment(order_id):
     """
     Handle payment for entire order
     """
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(Order.objects.only('total_paid'), id=order_id)
     
     metadata = {
         "type": "order",
@@ -262,13 +315,8 @@ def _handle_reservation_payment(reservation_id):
     """
     Handle payment for individual reservation
     """
-    reservation = get_object_or_404(Reservation, id=reservation_id)
-    
-    # Calculate total for this reservation
-    total_amount = sum(
-        selection.food_item.price * selection.quantity 
-        for selection in reservation.selection_set.all()
-    )
+    reservation = get_object_or_404(Reservation.objects.only('subtotal'), id=reservation_id)
+    total_amount = reservation.get_total_amount()
     
     metadata = {
         "type": "reservation",
@@ -285,33 +333,60 @@ def _handle_reservation_payment(reservation_id):
 
 
 # Admin views
+superuser_required = user_passes_test(
+    lambda user: user.is_superuser,
+    login_url='index',
+    redirect_field_name=None
+)
+
+
+@superuser_required
 def print_form(request, id):
     """
     Print form for kitchen preparation (admin only)
     """
-    if not request.user.is_superuser:
-        return redirect('index')
-    
     form = get_object_or_404(Form, id=id)
-    orders = Order.objects.filter(form=form)
-    display = ReportService.organize_orders_by_weekday(orders)
+    # Load only the columns the printout shows
+    reservations = (
+        Reservation.objects.filter(order__form=form)
+        .select_related('order__profile')
+        .only('id', 'weekday', 'order__id', 'order__profile__name', 'order__profile__department')
+        .prefetch_related(
+            Prefetch(
+                'selection_set',
+                queryset=Selection.objects.select_related('food_item').only(
+                    'id', 'reservation_id', 'quantity', 'food_item__name'
+                )
+            )
+        )
+        .order_by('weekday', 'id')
+    )
+    return StreamingHttpResponse(_render_print_form(reservations))
+
+
+def _render_print_form(reservations):
+    """
+    Render the print form piece by piece, so only one batch of reservations
+    is held in memory however many orders the form has
+    """
+    yield render_to_string("admin/print_form_start.html")
     
-    context = {
-        "weekdays": list(WEEKDAYS.values()),
-        "form": form,
-        "orders": orders,
-        "display": display,
-    }
-    return render(request, "admin/print_form.html", context)
+    rows = reservations.iterator(chunk_size=PRINT_FORM_BATCH_SIZE)
+    for weekday, day_reservations in groupby(rows, key=attrgetter('weekday')):
+        while batch := list(islice(day_reservations, PRINT_FORM_BATCH_SIZE)):
+            yield render_to_string("admin/print_form_cards.html", {
+                "weekday": WEEKDAYS[weekday],
+                "reservations": batch,
+            })
+    
+    yield render_to_string("admin/print_form_end.html")
 
 
+@superuser_required
 def check_quantities(request, id):
     """
     Check quantities needed for food preparation (admin only)
     """
-    if not request.user.is_superuser:
-        return redirect('index')
-    
     form = get_object_or_404(Form, id=id)
     count = ReportService.generate_quantity_report(form)
     
@@ -319,18 +394,24 @@ def check_quantities(request, id):
     return render(request, "admin/check_quantities.html", context)
 
 
+@superuser_required
 def check_order(request, id):
     """
     Check individual order details (admin only)
     """
-    if not request.user.is_superuser:
-        return redirect('index')
-    
-    order = get_object_or_404(Order, id=id)
+    order = get_object_or_404(
+        Order.objects.select_related('profile').prefetch_related(
+            Prefetch(
+                'reservations__selection_set',
+                queryset=Selection.objects.select_related('food_item')
+            )
+        ),
+        id=id
+    )
     display = ReportService.organize_orders_by_weekday([order])
     
     context = {
-        "weekdays": list(WEEKDAYS.values()),
+        "weekdays": WEEKDAY_NAMES,
         "display": display,
     }
     return render(request, "admin/check_order.html", context)
@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 from pathlib import Path
 import environ
 
+env = environ.Env()
 environ.Env.read_env()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -57,6 +58,13 @@ JAZZMIN_SETTINGS = {
     "order_with_respect_to": ["forms", "forms.lunchform","forms.snacksform"],
 }
 
+# Loads request.user together with its profile. ModelBackend stays listed so
+# sessions created before ProfileModelBackend existed are still accepted.
+AUTHENTICATION_BACKENDS = [
+    'forms.backends.ProfileModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -99,6 +107,10 @@ DATABASES = {
         'USER'    : 'root',                            
         'HOST'    : 'localhost',               
         'PORT'    : '3306',
+        # Keep connections open between requests instead of reconnecting
+        # every time; health checks drop ones the server has closed
+        'CONN_MAX_AGE'       : 60,
+        'CONN_HEALTH_CHECKS' : True,
     }
 }
 
@@ -148,4 +160,8 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-
+# Third-party API credentials, read once from the environment
+PAYMONGO_SECRET_KEY = env("PAYMONGO_SECRET_KEY")
+HOST_URL = env("HOST_URL")
+MICROSOFT_CLIENT_SECRET = env("MICROSOFT_CLIENT_SECRET")
+MICROSOFT_CLIENT_ID = env("MICROSOFT_CLIENT_ID")